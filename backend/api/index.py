@@ -188,7 +188,94 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                 'body': json.dumps({'offers': offers})
             }
-        
+
+        elif method == 'GET' and action == 'seller-stats':
+            headers = event.get('headers', {})
+            seller_id = int(headers.get('x-user-id', headers.get('X-User-Id', 0)))
+            
+            if not seller_id:
+                return {
+                    'statusCode': 401,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Необходима авторизация'})
+                }
+            
+            try:
+                days = min(max(int(params.get('days', 30)), 1), 365)
+            except ValueError:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Параметр days должен быть числом'})
+                }
+            
+            # Читаем только сводные таблицы: они обновляются при смене статуса сделки,
+            # поэтому время ответа не зависит от длины истории продавца
+            cursor.execute('''
+                SELECT revenue, deals_pending, deals_paid, deals_completed
+                FROM t_p18833766_gaming_account_marke.seller_stats
+                WHERE seller_id = %s
+            ''', (seller_id,))
+            
+            stats_row = cursor.fetchone() or (0, 0, 0, 0)
+            
+            cursor.execute('''
+                SELECT s.offer_id, o.title, s.deals_created, s.deals_paid, s.deals_completed, s.revenue
+                FROM t_p18833766_gaming_account_marke.seller_offer_stats s
+                JOIN t_p18833766_gaming_account_marke.offers o ON s.offer_id = o.id
+                WHERE s.seller_id = %s
+                ORDER BY s.deals_created DESC, s.offer_id
+                LIMIT 50
+            ''', (seller_id,))
+            
+            rows = cursor.fetchall()
+            offers = []
+            for row in rows:
+                offers.append({
+                    'id': row[0],
+                    'title': row[1],
+                    'deals_created': row[2],
+                    'deals_paid': row[3],
+                    'deals_completed': row[4],
+                    'revenue': row[5],
+                    'conversion': round(row[4] / row[2], 4) if row[2] else 0
+                })
+            
+            cursor.execute('''
+                SELECT d.day::date, COALESCE(s.deals_created, 0), COALESCE(s.deals_completed, 0), COALESCE(s.revenue, 0)
+                FROM generate_series(CURRENT_DATE - %s, CURRENT_DATE, interval '1 day') AS d(day)
+                LEFT JOIN t_p18833766_gaming_account_marke.seller_daily_stats s
+                    ON s.seller_id = %s AND s.day = d.day::date
+                ORDER BY d.day
+            ''', (days - 1, seller_id))
+            
+            rows = cursor.fetchall()
+            daily = []
+            for row in rows:
+                daily.append({
+                    'day': row[0].isoformat(),
+                    'deals_created': row[1],
+                    'deals_completed': row[2],
+                    'revenue': row[3]
+                })
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({
+                    'stats': {
+                        'revenue': stats_row[0],
+                        'deals': {
+                            'pending': stats_row[1],
+                            'paid': stats_row[2],
+                            'completed': stats_row[3]
+                        }
+                    },
+                    'offers': offers,
+                    'daily': daily
+                })
+            }
+
         else:
             return {
                 'statusCode': 404,
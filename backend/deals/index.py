@@ -1,7 +1,202 @@
 import json
 import os
+import select
 import psycopg2
-from typing import Dict, Any
+import psycopg2.extensions
+from typing import Dict, Any, Optional
+
+SCHEMA = 't_p18833766_gaming_account_marke'
+
+# Горячие запросы сделок: готовятся один раз на тёплое соединение (PREPARE),
+# дальше выполняются через EXECUTE без повторного разбора и планирования
+PREPARED_STATEMENTS = {
+    'deal_offer_with_balance': ('integer, integer', f'''
+        SELECT o.id, o.price, o.seller_id, o.title, u.username,
+               (SELECT balance FROM {SCHEMA}.users WHERE id = $2)
+        FROM {SCHEMA}.offers o
+        JOIN {SCHEMA}.users u ON o.seller_id = u.id
+        WHERE o.id = $1 AND o.status = 'active'
+    '''),
+    # Сделка и сводки продавца пишутся одним запросом, чтобы остаться атомарными в autocommit
+    'deal_insert': ('integer, integer, integer, integer', f'''
+        WITH deal AS (
+            INSERT INTO {SCHEMA}.deals (offer_id, buyer_id, seller_id, amount, status, rollup_status)
+            VALUES ($1, $2, $3, $4, 'pending', 'pending')
+            RETURNING id
+        ), stats AS (
+            INSERT INTO {SCHEMA}.seller_stats (seller_id, deals_pending)
+            VALUES ($3, 1)
+            ON CONFLICT (seller_id) DO UPDATE
+            SET deals_pending = seller_stats.deals_pending + 1, updated_at = CURRENT_TIMESTAMP
+        ), offer_stats AS (
+            INSERT INTO {SCHEMA}.seller_offer_stats (offer_id, seller_id, deals_created)
+            VALUES ($1, $3, 1)
+            ON CONFLICT (offer_id) DO UPDATE
+            SET deals_created = seller_offer_stats.deals_created + 1
+        ), daily_stats AS (
+            INSERT INTO {SCHEMA}.seller_daily_stats (seller_id, day, deals_created)
+            VALUES ($3, CURRENT_DATE, 1)
+            ON CONFLICT (seller_id, day) DO UPDATE
+            SET deals_created = seller_daily_stats.deals_created + 1
+        )
+        SELECT id FROM deal
+    '''),
+    'deal_by_id': ('integer', f'''
+        SELECT d.id, d.buyer_id, d.seller_id, d.amount, d.status
+        FROM {SCHEMA}.deals d
+        WHERE d.id = $1
+    '''),
+    # Смена статуса, движение денег и сводки — один запрос: всё остальное выполняется,
+    # только если UPDATE сделки прошёл проверку статуса, поэтому повторная оплата
+    # или подтверждение из параллельного вызова ничего не меняет.
+    # Сводки меняются на разницу между новым статусом и rollup_status — статусом,
+    # под которым сделка уже учтена (его читает подзапрос под FOR UPDATE). Сделка
+    # с rollup_status NULL в сводках не учтена: её создание досчитывается здесь же
+    'deal_pay': ('integer, integer', f'''
+        WITH deal AS (
+            UPDATE {SCHEMA}.deals d SET status = 'paid', rollup_status = 'paid'
+            FROM (SELECT id, rollup_status FROM {SCHEMA}.deals WHERE id = $1 FOR UPDATE) prev
+            WHERE d.id = prev.id AND d.buyer_id = $2 AND d.status = 'pending'
+            RETURNING d.id, d.seller_id, d.offer_id, d.amount, d.created_at,
+                      (prev.rollup_status IS NULL)::int AS untracked,
+                      COALESCE(prev.rollup_status = 'pending', false)::int AS was_pending
+        ), charge AS (
+            UPDATE {SCHEMA}.users SET balance = users.balance - deal.amount
+            FROM deal WHERE users.id = $2
+        ), payment AS (
+            INSERT INTO {SCHEMA}.transactions (user_id, deal_id, amount, type)
+            SELECT $2, deal.id, -deal.amount, 'payment' FROM deal
+        ), stats AS (
+            INSERT INTO {SCHEMA}.seller_stats (seller_id, deals_pending, deals_paid)
+            SELECT deal.seller_id, -deal.was_pending, 1 FROM deal
+            ON CONFLICT (seller_id) DO UPDATE
+            SET deals_pending = seller_stats.deals_pending + EXCLUDED.deals_pending,
+                deals_paid = seller_stats.deals_paid + EXCLUDED.deals_paid,
+                updated_at = CURRENT_TIMESTAMP
+        ), offer_stats AS (
+            INSERT INTO {SCHEMA}.seller_offer_stats (offer_id, seller_id, deals_created, deals_paid)
+            SELECT deal.offer_id, deal.seller_id, deal.untracked, 1 FROM deal
+            ON CONFLICT (offer_id) DO UPDATE
+            SET deals_created = seller_offer_stats.deals_created + EXCLUDED.deals_created,
+                deals_paid = seller_offer_stats.deals_paid + EXCLUDED.deals_paid
+        ), daily_stats AS (
+            INSERT INTO {SCHEMA}.seller_daily_stats (seller_id, day, deals_created)
+            SELECT deal.seller_id, deal.created_at::date, 1 FROM deal WHERE deal.untracked = 1
+            ON CONFLICT (seller_id, day) DO UPDATE
+            SET deals_created = seller_daily_stats.deals_created + EXCLUDED.deals_created
+        )
+        SELECT id FROM deal
+    '''),
+    'deal_complete': ('integer, integer, integer', f'''
+        WITH deal AS (
+            UPDATE {SCHEMA}.deals d
+            SET status = 'completed', rollup_status = 'completed', completed_at = CURRENT_TIMESTAMP
+            FROM (SELECT id, rollup_status FROM {SCHEMA}.deals WHERE id = $1 FOR UPDATE) prev
+            WHERE d.id = prev.id AND d.buyer_id = $2 AND d.status = 'paid'
+            RETURNING d.id, d.seller_id, d.offer_id, d.created_at,
+                      (prev.rollup_status IS NULL)::int AS untracked,
+                      COALESCE(prev.rollup_status = 'pending', false)::int AS was_pending,
+                      COALESCE(prev.rollup_status = 'paid', false)::int AS was_paid
+        ), payout AS (
+            UPDATE {SCHEMA}.users SET balance = users.balance + $3
+            FROM deal WHERE users.id = deal.seller_id
+        ), payout_transaction AS (
+            INSERT INTO {SCHEMA}.transactions (user_id, deal_id, amount, type)
+            SELECT deal.seller_id, deal.id, $3, 'payout' FROM deal
+        ), stats AS (
+            INSERT INTO {SCHEMA}.seller_stats (seller_id, deals_pending, deals_paid, deals_completed, revenue)
+            SELECT deal.seller_id, -deal.was_pending, -deal.was_paid, 1, $3 FROM deal
+            ON CONFLICT (seller_id) DO UPDATE
+            SET deals_pending = seller_stats.deals_pending + EXCLUDED.deals_pending,
+                deals_paid = seller_stats.deals_paid + EXCLUDED.deals_paid,
+                deals_completed = seller_stats.deals_completed + EXCLUDED.deals_completed,
+                revenue = seller_stats.revenue + EXCLUDED.revenue,
+                updated_at = CURRENT_TIMESTAMP
+        ), offer_stats AS (
+            INSERT INTO {SCHEMA}.seller_offer_stats (offer_id, seller_id, deals_created, deals_paid, deals_completed, revenue)
+            SELECT deal.offer_id, deal.seller_id, deal.untracked, 1 - deal.was_paid, 1, $3 FROM deal
+            ON CONFLICT (offer_id) DO UPDATE
+            SET deals_created = seller_offer_stats.deals_created + EXCLUDED.deals_created,
+                deals_paid = seller_offer_stats.deals_paid + EXCLUDED.deals_paid,
+                deals_completed = seller_offer_stats.deals_completed + EXCLUDED.deals_completed,
+                revenue = seller_offer_stats.revenue + EXCLUDED.revenue
+        ), daily_stats AS (
+            -- День создания неучтённой сделки может совпасть с сегодняшним:
+            -- обе строки сводятся в одну, чтобы upsert не задел строку дважды
+            INSERT INTO {SCHEMA}.seller_daily_stats (seller_id, day, deals_created, deals_completed, revenue)
+            SELECT seller_id, day, SUM(deals_created), SUM(deals_completed), SUM(revenue)
+            FROM (
+                SELECT deal.seller_id, deal.created_at::date AS day, 1 AS deals_created, 0 AS deals_completed, 0 AS revenue
+                FROM deal WHERE deal.untracked = 1
+                UNION ALL
+                SELECT deal.seller_id, CURRENT_DATE, 0, 1, $3 FROM deal
+            ) events
+            GROUP BY seller_id, day
+            ON CONFLICT (seller_id, day) DO UPDATE
+            SET deals_created = seller_daily_stats.deals_created + EXCLUDED.deals_created,
+                deals_completed = seller_daily_stats.deals_completed + EXCLUDED.deals_completed,
+                revenue = seller_daily_stats.revenue + EXCLUDED.revenue
+        )
+        SELECT id FROM deal
+    ''')
+}
+
+# PREPARE живёт в серверной сессии, поэтому DATABASE_URL должен вести прямо в
+# PostgreSQL или в пулер в session-режиме. За PgBouncer в transaction-режиме
+# следующий EXECUTE может попасть в другую сессию и упасть с
+# "prepared statement ... does not exist" (см. README, "База данных")
+_connection: Optional[psycopg2.extensions.connection] = None
+
+
+def get_connection(dsn: str) -> psycopg2.extensions.connection:
+    '''
+    Возвращает соединение, переживающее вызовы функции в тёплом контейнере.
+    Новое соединение работает в autocommit, а все PREPARE уходят одним запросом.
+    '''
+    global _connection
+    if _connection is not None and not _connection.closed:
+        # Без LISTEN в простаивающий сокет сервер пишет только при закрытии
+        # соединения (таймаут простоя, рестарт), поэтому проверка обходится без round-trip
+        readable, _, _ = select.select([_connection], [], [], 0)
+        if readable:
+            _connection.close()
+    if _connection is None or _connection.closed:
+        conn = psycopg2.connect(dsn)
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('; '.join(
+                    f'PREPARE {name} ({arg_types}) AS {sql}'
+                    for name, (arg_types, sql) in PREPARED_STATEMENTS.items()
+                ))
+        except psycopg2.Error:
+            conn.close()
+            raise
+        _connection = conn
+    return _connection
+
+
+def release_connection(conn: psycopg2.extensions.connection) -> None:
+    '''
+    Откатывает незавершённую транзакцию, чтобы следующий вызов получил чистое
+    соединение; сломанное соединение закрывается и будет открыто заново.
+    В autocommit psycopg2 сам BEGIN не отправлял и conn.rollback() ничего
+    не делает, поэтому ROLLBACK отправляется явно.
+    '''
+    global _connection
+    try:
+        status = conn.get_transaction_status()
+        if status in (psycopg2.extensions.TRANSACTION_STATUS_INTRANS,
+                      psycopg2.extensions.TRANSACTION_STATUS_INERROR):
+            with conn.cursor() as cursor:
+                cursor.execute('ROLLBACK')
+        elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            conn.close()
+    except psycopg2.Error:
+        conn.close()
+    if conn.closed:
+        _connection = None
+
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
@@ -31,7 +226,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({'error': 'DATABASE_URL not configured'})
         }
     
-    conn = psycopg2.connect(dsn)
+    conn = get_connection(dsn)
     cursor = conn.cursor()
     
     params = event.get('queryStringParameters', {}) or {}
@@ -51,12 +246,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'body': json.dumps({'error': 'Необходима авторизация'})
                 }
             
-            cursor.execute('''
-                SELECT o.id, o.price, o.seller_id, o.title, u.username
-                FROM t_p18833766_gaming_account_marke.offers o
-                JOIN t_p18833766_gaming_account_marke.users u ON o.seller_id = u.id
-                WHERE o.id = %s AND o.status = 'active'
-            ''', (offer_id,))
+            cursor.execute('EXECUTE deal_offer_with_balance (%s, %s)', (offer_id, user_id))
             
             offer_row = cursor.fetchone()
             if not offer_row:
@@ -77,11 +267,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'body': json.dumps({'error': 'Нельзя купить свой товар'})
                 }
             
-            cursor.execute(
-                'SELECT balance FROM t_p18833766_gaming_account_marke.users WHERE id = %s',
-                (user_id,)
-            )
-            buyer_balance = cursor.fetchone()[0]
+            buyer_balance = offer_row[5] or 0
             
             total_amount = int(price * 1.05)
             
@@ -92,15 +278,12 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'body': json.dumps({'error': f'Недостаточно средств. Нужно {total_amount}₽'})
                 }
             
-            cursor.execute('''
-                INSERT INTO t_p18833766_gaming_account_marke.deals 
-                (offer_id, buyer_id, seller_id, amount, status)
-                VALUES (%s, %s, %s, %s, 'pending')
-                RETURNING id
-            ''', (offer_id, user_id, seller_id, total_amount))
+            cursor.execute(
+                'EXECUTE deal_insert (%s, %s, %s, %s)',
+                (offer_id, user_id, seller_id, total_amount)
+            )
             
             deal_id = cursor.fetchone()[0]
-            conn.commit()
             
             return {
                 'statusCode': 200,
@@ -123,11 +306,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'body': json.dumps({'error': 'Необходима авторизация'})
                 }
             
-            cursor.execute('''
-                SELECT d.id, d.buyer_id, d.seller_id, d.amount, d.status
-                FROM t_p18833766_gaming_account_marke.deals d
-                WHERE d.id = %s
-            ''', (deal_id,))
+            cursor.execute('EXECUTE deal_by_id (%s)', (deal_id,))
             
             deal_row = cursor.fetchone()
             if not deal_row:
@@ -151,25 +330,13 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'body': json.dumps({'error': 'Сделка уже оплачена'})
                 }
             
-            amount = deal_row[3]
-            
-            cursor.execute(
-                'UPDATE t_p18833766_gaming_account_marke.users SET balance = balance - %s WHERE id = %s',
-                (amount, user_id)
-            )
-            
-            cursor.execute(
-                'UPDATE t_p18833766_gaming_account_marke.deals SET status = %s WHERE id = %s',
-                ('paid', deal_id)
-            )
-            
-            cursor.execute('''
-                INSERT INTO t_p18833766_gaming_account_marke.transactions 
-                (user_id, deal_id, amount, type)
-                VALUES (%s, %s, %s, 'payment')
-            ''', (user_id, deal_id, -amount))
-            
-            conn.commit()
+            cursor.execute('EXECUTE deal_pay (%s, %s)', (deal_id, user_id))
+            if not cursor.fetchone():
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Сделка уже оплачена'})
+                }
             
             return {
                 'statusCode': 200,
@@ -188,11 +355,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'body': json.dumps({'error': 'Необходима авторизация'})
                 }
             
-            cursor.execute('''
-                SELECT d.id, d.buyer_id, d.seller_id, d.amount, d.status
-                FROM t_p18833766_gaming_account_marke.deals d
-                WHERE d.id = %s
-            ''', (deal_id,))
+            cursor.execute('EXECUTE deal_by_id (%s)', (deal_id,))
             
             deal_row = cursor.fetchone()
             if not deal_row or deal_row[1] != user_id:
@@ -209,27 +372,16 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'body': json.dumps({'error': 'Сделка не оплачена'})
                 }
             
-            seller_id = deal_row[2]
             amount = deal_row[3]
             seller_amount = int(amount * 0.95)
             
-            cursor.execute(
-                'UPDATE t_p18833766_gaming_account_marke.users SET balance = balance + %s WHERE id = %s',
-                (seller_amount, seller_id)
-            )
-            
-            cursor.execute(
-                'UPDATE t_p18833766_gaming_account_marke.deals SET status = %s, completed_at = CURRENT_TIMESTAMP WHERE id = %s',
-                ('completed', deal_id)
-            )
-            
-            cursor.execute('''
-                INSERT INTO t_p18833766_gaming_account_marke.transactions 
-                (user_id, deal_id, amount, type)
-                VALUES (%s, %s, %s, 'payout')
-            ''', (seller_id, deal_id, seller_amount))
-            
-            conn.commit()
+            cursor.execute('EXECUTE deal_complete (%s, %s, %s)', (deal_id, user_id, seller_amount))
+            if not cursor.fetchone():
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Сделка не оплачена'})
+                }
             
             return {
                 'statusCode': 200,
@@ -298,7 +450,6 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             ''', (deal_id, user_id, message))
             
             message_id = cursor.fetchone()[0]
-            conn.commit()
             
             return {
                 'statusCode': 200,
@@ -350,4 +501,4 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     finally:
         cursor.close()
-        conn.close()
+        release_connection(conn)
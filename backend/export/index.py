@@ -0,0 +1,279 @@
+import base64
+import gzip
+import hmac
+import io
+import json
+import os
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, Any, Optional
+
+import psycopg2
+
+SCHEMA = 't_p18833766_gaming_account_marke'
+
+EXPORT_QUERIES = {
+    'deals': f'''
+        SELECT d.id, d.created_at, d.completed_at, d.status, d.amount,
+               d.offer_id, o.title AS offer_title, o.price AS offer_price,
+               d.buyer_id, buyer.username AS buyer_name,
+               d.seller_id, seller.username AS seller_name
+        FROM {SCHEMA}.deals d
+        JOIN {SCHEMA}.offers o ON d.offer_id = o.id
+        JOIN {SCHEMA}.users buyer ON d.buyer_id = buyer.id
+        JOIN {SCHEMA}.users seller ON d.seller_id = seller.id
+        WHERE d.created_at >= %s AND d.created_at < COALESCE(%s, CURRENT_DATE + 1)
+    ''',
+    'transactions': f'''
+        SELECT t.id, t.created_at, t.type, t.status, t.amount,
+               t.user_id, u.username,
+               t.deal_id, d.status AS deal_status,
+               d.offer_id, o.title AS offer_title
+        FROM {SCHEMA}.transactions t
+        JOIN {SCHEMA}.users u ON t.user_id = u.id
+        LEFT JOIN {SCHEMA}.deals d ON t.deal_id = d.id
+        LEFT JOIN {SCHEMA}.offers o ON d.offer_id = o.id
+        WHERE t.created_at >= %s AND t.created_at < COALESCE(%s, CURRENT_DATE + 1)
+    '''
+}
+
+# created_at — TIMESTAMP без зоны, записанный CURRENT_TIMESTAMP базы, поэтому даты
+# from/to и граница "сегодня" по умолчанию считаются во временной зоне базы, а не функции
+STATUS_COLUMNS = {'deals': 'd.status', 'transactions': 't.status'}
+KEY_COLUMNS = {'deals': '(d.created_at, d.id)', 'transactions': '(t.created_at, t.id)'}
+ORDER_COLUMNS = {'deals': 'd.created_at, d.id', 'transactions': 't.created_at, t.id'}
+
+# В CSV-режиме COPY не экранирует обратные слеши, поэтому JSON уходит как есть:
+# кавычка и разделитель заменены на управляющие символы, которых в JSON не бывает
+NDJSON_COPY_OPTIONS = "(FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02')"
+CSV_COPY_OPTIONS = '(FORMAT csv, HEADER true)'
+
+# Ответ функции отдаётся целиком (base64 даёт +33%), поэтому выгрузка идёт
+# страницами по ключу (created_at, id): каждая страница — не больше limit строк,
+# в заголовке X-Export-Next возвращается токен для следующей страницы.
+# Если сжатая страница не помещается в EXPORT_MAX_BYTES, COPY прерывается
+# и страница повторяется с вдвое меньшим limit; 413 — только если не влезает одна строка
+EXPORT_PAGE_ROWS = 20000
+EXPORT_MAX_PAGE_ROWS = 500000
+EXPORT_MAX_BYTES = int(os.environ.get('EXPORT_MAX_BYTES', 3 * 1024 * 1024))
+
+
+class ExportTooLarge(Exception):
+    pass
+
+
+class CappedGzipWriter:
+    '''
+    Принимает поток COPY, сжимает его в буфер и прерывает выгрузку,
+    как только сжатый размер превышает лимит — память ограничена лимитом.
+    '''
+
+    def __init__(self, buffer: io.BytesIO, limit: int):
+        self.buffer = buffer
+        self.limit = limit
+        self.gz = gzip.GzipFile(fileobj=buffer, mode='wb', mtime=0)
+
+    def write(self, data: bytes) -> int:
+        written = self.gz.write(data)
+        self.check()
+        return written
+
+    def close(self) -> None:
+        self.gz.close()
+        self.check()
+
+    def check(self) -> None:
+        if self.buffer.tell() > self.limit:
+            raise ExportTooLarge()
+
+
+def parse_date(value: Optional[str], default: Optional[date]) -> Optional[date]:
+    if not value:
+        return default
+    return date.fromisoformat(value)
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    payload = json.dumps({'created_at': created_at.isoformat(), 'id': row_id})
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(token: str) -> tuple:
+    payload = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+    return datetime.fromisoformat(payload['created_at']), int(payload['id'])
+
+
+def copy_page(cursor: Any, entity: str, export_format: str, query: str,
+              query_params: list, limit: int) -> tuple:
+    '''
+    Выгружает через COPY не больше limit строк в сжатый буфер.
+    Returns: (буфер с gzip, ключ последней строки или None, если страница последняя)
+    '''
+    # Последний ключ страницы находим заранее по индексу (created_at, id):
+    # COPY выгружает строки до него включительно, а сам ключ становится токеном
+    cursor.execute(
+        f'SELECT created_at, id FROM ({query} ORDER BY {ORDER_COLUMNS[entity]}) page OFFSET %s LIMIT 1',
+        query_params + [limit - 1]
+    )
+    last_key = cursor.fetchone()
+    page_params = list(query_params)
+    if last_key:
+        query += f' AND {KEY_COLUMNS[entity]} <= (%s, %s)'
+        page_params.extend(last_key)
+    query += f' ORDER BY {ORDER_COLUMNS[entity]}'
+
+    select_sql = cursor.mogrify(query, page_params).decode('utf-8')
+    if export_format == 'ndjson':
+        copy_sql = f'COPY (SELECT row_to_json(r) FROM ({select_sql}) r) TO STDOUT WITH {NDJSON_COPY_OPTIONS}'
+    else:
+        copy_sql = f'COPY ({select_sql}) TO STDOUT WITH {CSV_COPY_OPTIONS}'
+
+    buffer = io.BytesIO()
+    writer = CappedGzipWriter(buffer, EXPORT_MAX_BYTES)
+    cursor.copy_expert(copy_sql, writer)
+    writer.close()
+    return buffer, last_key
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Выгрузка сделок и транзакций для бухгалтерии (CSV/NDJSON в gzip)
+    Args: event с queryStringParameters: entity, format, from, to, status, limit, after
+    Returns: HTTP response с gzip-страницей в base64, токеном следующей страницы и статистикой
+    '''
+    method: str = event.get('httpMethod', 'GET')
+
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Export-Token',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': ''
+        }
+
+    dsn = os.environ.get('DATABASE_URL')
+    if not dsn:
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'DATABASE_URL not configured'})
+        }
+
+    # Без EXPORT_TOKEN выгрузка выключена: доступ запрещён любому запросу
+    export_token = os.environ.get('EXPORT_TOKEN', '')
+    headers = event.get('headers', {}) or {}
+    token = headers.get('x-export-token', headers.get('X-Export-Token', ''))
+    if not export_token or not hmac.compare_digest(token.encode('utf-8'), export_token.encode('utf-8')):
+        return {
+            'statusCode': 403,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Доступ запрещён'})
+        }
+
+    if method != 'GET':
+        return {
+            'statusCode': 404,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Not found'})
+        }
+
+    params = event.get('queryStringParameters', {}) or {}
+    entity = params.get('entity', 'deals')
+    export_format = params.get('format', 'csv')
+    status = params.get('status')
+
+    if entity not in EXPORT_QUERIES or export_format not in ('csv', 'ndjson'):
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'entity: deals|transactions, format: csv|ndjson'})
+        }
+
+    try:
+        date_from = parse_date(params.get('from'), date(1970, 1, 1))
+        date_to = parse_date(params.get('to'), None)
+    except ValueError:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Даты указываются в формате YYYY-MM-DD'})
+        }
+
+    try:
+        limit = min(max(int(params.get('limit', EXPORT_PAGE_ROWS)), 1), EXPORT_MAX_PAGE_ROWS)
+        after = decode_cursor(params['after']) if params.get('after') else None
+    except (ValueError, KeyError, TypeError):
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Неверные параметры limit или after'})
+        }
+
+    conn = psycopg2.connect(dsn)
+    cursor = conn.cursor()
+
+    try:
+        query = EXPORT_QUERIES[entity]
+        query_params = [date_from, date_to + timedelta(days=1) if date_to else None]
+        if status:
+            query += f' AND {STATUS_COLUMNS[entity]} = %s'
+            query_params.append(status)
+        if after:
+            query += f' AND {KEY_COLUMNS[entity]} > (%s, %s)'
+            query_params.extend(after)
+
+        started = time.perf_counter()
+        while True:
+            try:
+                buffer, last_key = copy_page(cursor, entity, export_format, query, query_params, limit)
+                break
+            except ExportTooLarge:
+                if limit == 1:
+                    return {
+                        'statusCode': 413,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({
+                            'error': 'Строка выгрузки не помещается в лимит ответа',
+                            'max_bytes': EXPORT_MAX_BYTES
+                        })
+                    }
+                limit = max(limit // 2, 1)
+        elapsed = time.perf_counter() - started
+
+        rows = max(cursor.rowcount, 0)
+        rows_per_sec = int(rows / elapsed) if elapsed > 0 else rows
+        body = base64.b64encode(buffer.getvalue()).decode('ascii')
+
+        extension = 'csv' if export_format == 'csv' else 'ndjson'
+        date_to_label = date_to.isoformat() if date_to else 'today'
+        filename = f'{entity}_{date_from.isoformat()}_{date_to_label}.{extension}.gz'
+
+        response_headers = {
+            'Content-Type': 'application/gzip',
+            'Content-Disposition': f'attachment; filename="{filename}"',
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Expose-Headers': 'X-Export-Rows, X-Export-Limit, X-Export-Duration-Ms, X-Export-Rows-Per-Sec, X-Export-Next',
+            'X-Export-Rows': str(rows),
+            'X-Export-Limit': str(limit),
+            'X-Export-Duration-Ms': str(int(elapsed * 1000)),
+            'X-Export-Rows-Per-Sec': str(rows_per_sec)
+        }
+        # Полная страница: за ней могут быть ещё строки. Пустая последняя страница
+        # возможна, если строк ровно кратно limit — тогда в ней нет токена
+        if last_key:
+            response_headers['X-Export-Next'] = encode_cursor(last_key[0], last_key[1])
+
+        return {
+            'statusCode': 200,
+            'headers': response_headers,
+            'isBase64Encoded': True,
+            'body': body
+        }
+
+    finally:
+        cursor.close()
+        conn.close()
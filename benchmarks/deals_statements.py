@@ -0,0 +1,261 @@
+'''
+Бенчмарк действий сделок (create, pay, complete) до и после перехода
+на подготовленные запросы в backend/deals/index.py.
+
+Версия "до" берётся из git (родитель коммита, который добавил
+PREPARED_STATEMENTS), версия "после" — из рабочего дерева. Обе версии
+вызываются через handler, round-trip'ы к базе считаются подменой фабрик
+соединения и курсора psycopg2.
+
+Отдельно на одном соединении сравнивается каждый подготовленный запрос с тем
+же SQL, отправленным текстом: серверное время планирования из
+EXPLAIN (ANALYZE, SUMMARY) и клиентская задержка, в которую входит ещё и
+разбор. Каждый прогон идёт в своём SAVEPOINT и откатывается, так что pay и
+complete каждый раз выполняют настоящую работу; вся транзакция затем откатывается.
+
+Запуск только на тестовой базе (та же TEST_DATABASE_URL, что у tests/) —
+скрипт создаёт и затем удаляет пользователей, объявление, сделки и транзакции:
+
+    TEST_DATABASE_URL=postgres://... python benchmarks/deals_statements.py -n 200
+'''
+import argparse
+import importlib.util
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, Any, List
+
+import psycopg2
+import psycopg2.extensions
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEALS_PATH = 'backend/deals/index.py'
+ACTIONS = ('create', 'pay', 'complete')
+
+
+class Counters:
+    connects = 0
+    round_trips = 0
+
+    @classmethod
+    def reset(cls) -> None:
+        cls.connects = 0
+        cls.round_trips = 0
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    def execute(self, query: Any, vars: Any = None) -> Any:
+        conn = self.connection
+        if not conn.autocommit and conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            Counters.round_trips += 1  # неявный BEGIN
+        Counters.round_trips += 1
+        return super().execute(query, vars)
+
+
+class CountingConnection(psycopg2.extensions.connection):
+    def cursor(self, *args: Any, **kwargs: Any) -> Any:
+        kwargs.setdefault('cursor_factory', CountingCursor)
+        return super().cursor(*args, **kwargs)
+
+    def commit(self) -> None:
+        if self.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            Counters.round_trips += 1
+        super().commit()
+
+    def rollback(self) -> None:
+        if self.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            Counters.round_trips += 1
+        super().rollback()
+
+
+_original_connect = psycopg2.connect
+
+
+def counting_connect(dsn: str, **kwargs: Any) -> Any:
+    Counters.connects += 1
+    kwargs.setdefault('connection_factory', CountingConnection)
+    return _original_connect(dsn, **kwargs)
+
+
+def load_module(name: str, path: str) -> Any:
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_before_module(tmp_dir: str) -> Any:
+    introduced = subprocess.run(
+        ['git', 'log', '--reverse', '--format=%H', '-S', 'PREPARED_STATEMENTS', '--', DEALS_PATH],
+        cwd=ROOT, check=True, capture_output=True, text=True
+    ).stdout.split()
+    if not introduced:
+        sys.exit('Не найден коммит с PREPARED_STATEMENTS')
+    source = subprocess.run(
+        ['git', 'show', f'{introduced[0]}^:{DEALS_PATH}'],
+        cwd=ROOT, check=True, capture_output=True, text=True
+    ).stdout
+    path = os.path.join(tmp_dir, 'deals_before.py')
+    with open(path, 'w') as f:
+        f.write(source)
+    return load_module('deals_before', path)
+
+
+def call(module: Any, action: str, user_id: int, body: Dict[str, Any]) -> Dict[str, Any]:
+    response = module.handler({
+        'httpMethod': 'POST',
+        'queryStringParameters': {'action': action},
+        'headers': {'X-User-Id': str(user_id)},
+        'body': json.dumps(body)
+    }, None)
+    if response['statusCode'] != 200:
+        raise RuntimeError(f'{action}: {response["statusCode"]} {response["body"]}')
+    return json.loads(response['body'])
+
+
+def run(module: Any, ids: Dict[str, int], iterations: int) -> Dict[str, Dict[str, float]]:
+    timings: Dict[str, List[float]] = {action: [] for action in ACTIONS}
+    trips = {action: 0 for action in ACTIONS}
+    connects = {action: 0 for action in ACTIONS}
+
+    for _ in range(iterations):
+        deal_id = None
+        for action in ACTIONS:
+            body = {'offer_id': ids['offer']} if action == 'create' else {'deal_id': deal_id}
+            Counters.reset()
+            started = time.perf_counter()
+            result = call(module, action, ids['buyer'], body)
+            timings[action].append((time.perf_counter() - started) * 1000)
+            trips[action] += Counters.round_trips
+            connects[action] += Counters.connects
+            if action == 'create':
+                deal_id = result['deal_id']
+
+    return {
+        action: {
+            'median_ms': statistics.median(timings[action]),
+            'p95_ms': sorted(timings[action])[int(len(timings[action]) * 0.95) - 1],
+            'round_trips': trips[action] / iterations,
+            'connects': connects[action] / iterations
+        }
+        for action in ACTIONS
+    }
+
+
+def explain_planning_ms(cursor: Any, sql: str, params: Any) -> float:
+    cursor.execute('SAVEPOINT measure')
+    cursor.execute('EXPLAIN (ANALYZE, SUMMARY, FORMAT JSON) ' + sql, params)
+    plan = cursor.fetchone()[0]
+    cursor.execute('ROLLBACK TO SAVEPOINT measure')
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Planning Time']
+
+
+def timed_execute_ms(cursor: Any, sql: str, params: Any) -> float:
+    '''
+    Выполняет запрос внутри SAVEPOINT и откатывает его: каждый прогон видит
+    те же данные, поэтому pay и complete каждый раз реально меняют сделку,
+    а не упираются в проверку статуса.
+    '''
+    cursor.execute('SAVEPOINT measure')
+    started = time.perf_counter()
+    cursor.execute(sql, params)
+    elapsed = (time.perf_counter() - started) * 1000
+    if cursor.rowcount < 1:
+        raise RuntimeError(f'Запрос ничего не сделал: {sql}')
+    cursor.execute('ROLLBACK TO SAVEPOINT measure')
+    return elapsed
+
+
+def measure_parse(after: Any, dsn: str, ids: Dict[str, int], iterations: int) -> Dict[str, Dict[str, float]]:
+    conn = after.get_connection(dsn)
+    cursor = conn.cursor()
+    cursor.execute('BEGIN')
+    try:
+        insert_args = (ids['offer'], ids['buyer'], ids['seller'], 105)
+        cursor.execute('EXECUTE deal_insert (%s, %s, %s, %s)', insert_args)
+        pending_deal_id = cursor.fetchone()[0]
+        cursor.execute('EXECUTE deal_insert (%s, %s, %s, %s)', insert_args)
+        paid_deal_id = cursor.fetchone()[0]
+        cursor.execute('EXECUTE deal_pay (%s, %s)', (paid_deal_id, ids['buyer']))
+        args = {
+            'deal_offer_with_balance': (ids['offer'], ids['buyer']),
+            'deal_insert': insert_args,
+            'deal_by_id': (pending_deal_id,),
+            'deal_pay': (pending_deal_id, ids['buyer']),
+            'deal_complete': (paid_deal_id, ids['buyer'], 99)
+        }
+        results = {}
+        for name, values in args.items():
+            # $1..$n -> %(p1)s..%(pn)s: тот же запрос, но с разбором и планированием на каждом вызове
+            text_sql = re.sub(r'\$(\d+)', r'%(p\1)s', after.PREPARED_STATEMENTS[name][1])
+            text_params = {f'p{i}': value for i, value in enumerate(values, 1)}
+            execute_sql = f'EXECUTE {name} ({", ".join(["%s"] * len(values))})'
+
+            latency: Dict[str, List[float]] = {'text': [], 'prepared': []}
+            for _ in range(iterations):
+                latency['text'].append(timed_execute_ms(cursor, text_sql, text_params))
+                latency['prepared'].append(timed_execute_ms(cursor, execute_sql, values))
+
+            results[name] = {
+                'text_plan_ms': explain_planning_ms(cursor, text_sql, text_params),
+                'prepared_plan_ms': explain_planning_ms(cursor, execute_sql, values),
+                'text_ms': statistics.median(latency['text']),
+                'prepared_ms': statistics.median(latency['prepared'])
+            }
+        return results
+    finally:
+        cursor.execute('ROLLBACK')
+        cursor.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--iterations', type=int, default=100)
+    args = parser.parse_args()
+
+    dsn = os.environ.get('TEST_DATABASE_URL')
+    if not dsn:
+        sys.exit('TEST_DATABASE_URL not configured')
+    # handler обеих версий читает DATABASE_URL — направляем его в тестовую базу
+    os.environ['DATABASE_URL'] = dsn
+
+    setup_conn = _original_connect(dsn)
+    marketplace = load_module('marketplace', os.path.join(ROOT, 'tests', 'marketplace.py'))
+    ids = marketplace.seed_marketplace(setup_conn, 'bench', 10 ** 9)
+    psycopg2.connect = counting_connect
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            before = load_before_module(tmp_dir)
+            after = load_module('deals_after', os.path.join(ROOT, DEALS_PATH))
+            # первый вызов "после" открывает соединение и делает PREPARE — это прогрев
+            call(after, 'create', ids['buyer'], {'offer_id': ids['offer']})
+            results = {'before': run(before, ids, args.iterations), 'after': run(after, ids, args.iterations)}
+            parse = measure_parse(after, dsn, ids, args.iterations)
+    finally:
+        psycopg2.connect = _original_connect
+        marketplace.cleanup_marketplace(setup_conn, ids)
+        setup_conn.close()
+
+    print(f'{"action":<10}{"variant":<8}{"median ms":>11}{"p95 ms":>9}{"round-trips":>13}{"connects":>10}')
+    for action in ACTIONS:
+        for variant in ('before', 'after'):
+            r = results[variant][action]
+            print(f'{action:<10}{variant:<8}{r["median_ms"]:>11.2f}{r["p95_ms"]:>9.2f}'
+                  f'{r["round_trips"]:>13.1f}{r["connects"]:>10.1f}')
+
+    print()
+    print(f'{"statement":<26}{"plan ms text":>14}{"plan ms prep":>14}{"median ms text":>16}{"median ms prep":>16}')
+    for name, r in parse.items():
+        print(f'{name:<26}{r["text_plan_ms"]:>14.3f}{r["prepared_plan_ms"]:>14.3f}'
+              f'{r["text_ms"]:>16.3f}{r["prepared_ms"]:>16.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,3 @@
+-- Индексы для выгрузки сделок и транзакций по диапазону дат
+CREATE INDEX IF NOT EXISTS idx_deals_created_at ON deals(created_at, id);
+CREATE INDEX IF NOT EXISTS idx_transactions_created_at ON transactions(created_at, id);
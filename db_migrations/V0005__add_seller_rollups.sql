@@ -0,0 +1,69 @@
+-- Сводная статистика продавца (текущее число сделок по статусам и выручка)
+CREATE TABLE IF NOT EXISTS seller_stats (
+    seller_id INTEGER PRIMARY KEY REFERENCES users(id),
+    revenue BIGINT NOT NULL DEFAULT 0,
+    deals_pending INTEGER NOT NULL DEFAULT 0,
+    deals_paid INTEGER NOT NULL DEFAULT 0,
+    deals_completed INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Воронка по объявлениям: сколько сделок создано, оплачено и завершено
+CREATE TABLE IF NOT EXISTS seller_offer_stats (
+    offer_id INTEGER PRIMARY KEY REFERENCES offers(id),
+    seller_id INTEGER NOT NULL REFERENCES users(id),
+    deals_created INTEGER NOT NULL DEFAULT 0,
+    deals_paid INTEGER NOT NULL DEFAULT 0,
+    deals_completed INTEGER NOT NULL DEFAULT 0,
+    revenue BIGINT NOT NULL DEFAULT 0
+);
+
+-- Дневной ряд продавца: созданные и завершённые сделки, выручка по дню завершения
+CREATE TABLE IF NOT EXISTS seller_daily_stats (
+    seller_id INTEGER NOT NULL REFERENCES users(id),
+    day DATE NOT NULL,
+    deals_created INTEGER NOT NULL DEFAULT 0,
+    deals_completed INTEGER NOT NULL DEFAULT 0,
+    revenue BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (seller_id, day)
+);
+
+CREATE INDEX IF NOT EXISTS idx_seller_offer_stats_seller ON seller_offer_stats(seller_id, deals_created DESC);
+
+-- Заполняем сводные таблицы по уже существующим сделкам
+INSERT INTO seller_stats (seller_id, revenue, deals_pending, deals_paid, deals_completed)
+SELECT d.seller_id,
+       COALESCE(SUM(p.amount), 0),
+       COUNT(*) FILTER (WHERE d.status = 'pending'),
+       COUNT(*) FILTER (WHERE d.status = 'paid'),
+       COUNT(*) FILTER (WHERE d.status = 'completed')
+FROM deals d
+LEFT JOIN transactions p ON p.deal_id = d.id AND p.type = 'payout'
+GROUP BY d.seller_id
+ON CONFLICT (seller_id) DO NOTHING;
+
+INSERT INTO seller_offer_stats (offer_id, seller_id, deals_created, deals_paid, deals_completed, revenue)
+SELECT d.offer_id,
+       MIN(d.seller_id),
+       COUNT(*),
+       COUNT(*) FILTER (WHERE d.status IN ('paid', 'completed')),
+       COUNT(*) FILTER (WHERE d.status = 'completed'),
+       COALESCE(SUM(p.amount), 0)
+FROM deals d
+LEFT JOIN transactions p ON p.deal_id = d.id AND p.type = 'payout'
+GROUP BY d.offer_id
+ON CONFLICT (offer_id) DO NOTHING;
+
+INSERT INTO seller_daily_stats (seller_id, day, deals_created, deals_completed, revenue)
+SELECT seller_id, day, SUM(deals_created), SUM(deals_completed), SUM(revenue)
+FROM (
+    SELECT seller_id, created_at::date AS day, 1 AS deals_created, 0 AS deals_completed, 0 AS revenue
+    FROM deals
+    UNION ALL
+    SELECT d.seller_id, d.completed_at::date, 0, 1, COALESCE(p.amount, 0)
+    FROM deals d
+    LEFT JOIN transactions p ON p.deal_id = d.id AND p.type = 'payout'
+    WHERE d.status = 'completed' AND d.completed_at IS NOT NULL
+) events
+GROUP BY seller_id, day
+ON CONFLICT (seller_id, day) DO NOTHING;
@@ -0,0 +1,45 @@
+-- Статус, под которым сделка учтена в сводных таблицах; NULL — сделка в сводках
+-- не учтена (создана кодом без сводок). Смена статуса считает разницу от него
+ALTER TABLE deals ADD COLUMN IF NOT EXISTS rollup_status VARCHAR(50);
+
+UPDATE deals SET rollup_status = status;
+
+-- Пересобираем сводки по отмеченным сделкам: всё, что успело разойтись
+-- после бэкфилла V0005, выравнивается вместе с отметками
+DELETE FROM seller_daily_stats;
+DELETE FROM seller_offer_stats;
+DELETE FROM seller_stats;
+
+INSERT INTO seller_stats (seller_id, revenue, deals_pending, deals_paid, deals_completed)
+SELECT d.seller_id,
+       COALESCE(SUM(p.amount), 0),
+       COUNT(*) FILTER (WHERE d.rollup_status = 'pending'),
+       COUNT(*) FILTER (WHERE d.rollup_status = 'paid'),
+       COUNT(*) FILTER (WHERE d.rollup_status = 'completed')
+FROM deals d
+LEFT JOIN transactions p ON p.deal_id = d.id AND p.type = 'payout'
+GROUP BY d.seller_id;
+
+INSERT INTO seller_offer_stats (offer_id, seller_id, deals_created, deals_paid, deals_completed, revenue)
+SELECT d.offer_id,
+       MIN(d.seller_id),
+       COUNT(*),
+       COUNT(*) FILTER (WHERE d.rollup_status IN ('paid', 'completed')),
+       COUNT(*) FILTER (WHERE d.rollup_status = 'completed'),
+       COALESCE(SUM(p.amount), 0)
+FROM deals d
+LEFT JOIN transactions p ON p.deal_id = d.id AND p.type = 'payout'
+GROUP BY d.offer_id;
+
+INSERT INTO seller_daily_stats (seller_id, day, deals_created, deals_completed, revenue)
+SELECT seller_id, day, SUM(deals_created), SUM(deals_completed), SUM(revenue)
+FROM (
+    SELECT seller_id, created_at::date AS day, 1 AS deals_created, 0 AS deals_completed, 0 AS revenue
+    FROM deals
+    UNION ALL
+    SELECT d.seller_id, d.completed_at::date, 0, 1, COALESCE(p.amount, 0)
+    FROM deals d
+    LEFT JOIN transactions p ON p.deal_id = d.id AND p.type = 'payout'
+    WHERE d.rollup_status = 'completed' AND d.completed_at IS NOT NULL
+) events
+GROUP BY seller_id, day;
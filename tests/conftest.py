@@ -0,0 +1,69 @@
+import importlib.util
+import json
+import os
+from typing import Any, Dict
+
+import pytest
+
+from marketplace import SCHEMA, cleanup_marketplace, seed_marketplace
+
+try:
+    import psycopg2
+except ImportError:
+    # Тесты работают с настоящей базой; без драйвера их нечем запускать
+    psycopg2 = None
+    collect_ignore_glob = ['test_*.py']
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_function(name: str) -> Any:
+    '''Загружает backend/<name>/index.py как отдельный модуль, как это делает среда функций.'''
+    path = os.path.join(ROOT, 'backend', name, 'index.py')
+    spec = importlib.util.spec_from_file_location(f'{name}_index', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def dsn() -> str:
+    '''
+    Тесты создают и удаляют пользователей, объявления и сделки, поэтому база
+    задаётся отдельной переменной TEST_DATABASE_URL, а не DATABASE_URL функций.
+    '''
+    value = os.environ.get('TEST_DATABASE_URL')
+    if not value:
+        pytest.skip('TEST_DATABASE_URL not configured')
+    return value
+
+
+@pytest.fixture
+def marketplace(dsn: str) -> Dict[str, int]:
+    '''Продавец, покупатель с балансом и активное объявление; всё удаляется после теста.'''
+    conn = psycopg2.connect(dsn)
+    ids = seed_marketplace(conn, 'test', 10 ** 6)
+    yield ids
+    cleanup_marketplace(conn, ids)
+    conn.close()
+
+
+@pytest.fixture
+def deals(monkeypatch: pytest.MonkeyPatch, dsn: str) -> Any:
+    monkeypatch.setenv('DATABASE_URL', dsn)
+    module = load_function('deals')
+    yield module
+    # соединение модульное и переживает вызовы handler, как в тёплом контейнере
+    if module._connection is not None:
+        module._connection.close()
+
+
+def call(module: Any, method: str, user_id: int, params: Dict[str, str], body: Dict[str, Any] = None) -> Dict[str, Any]:
+    '''Вызывает handler от имени пользователя; к телу ответа добавляется status_code.'''
+    response = module.handler({
+        'httpMethod': method,
+        'queryStringParameters': params,
+        'headers': {'X-User-Id': str(user_id)},
+        'body': json.dumps(body or {})
+    }, None)
+    return {**json.loads(response['body']), 'status_code': response['statusCode']}
@@ -0,0 +1,48 @@
+'''
+Тестовые данные маркетплейса: продавец, покупатель с балансом и активное
+объявление. Используется фикстурой marketplace и бенчмарками.
+'''
+import uuid
+from typing import Any, Dict
+
+SCHEMA = 't_p18833766_gaming_account_marke'
+
+
+def seed_marketplace(conn: Any, prefix: str, buyer_balance: int) -> Dict[str, int]:
+    suffix = uuid.uuid4().hex[:8]
+    ids: Dict[str, int] = {}
+    with conn.cursor() as cursor:
+        cursor.execute(f'''
+            SELECT g.id, gc.id FROM {SCHEMA}.games g
+            JOIN {SCHEMA}.game_categories gc ON gc.game_id = g.id
+            LIMIT 1
+        ''')
+        game_id, category_id = cursor.fetchone()
+        for role, balance in (('seller', 0), ('buyer', buyer_balance)):
+            cursor.execute(f'''
+                INSERT INTO {SCHEMA}.users (username, email, balance)
+                VALUES (%s, %s, %s) RETURNING id
+            ''', (f'{prefix}_{role}_{suffix}', f'{prefix}_{role}_{suffix}@example.com', balance))
+            ids[role] = cursor.fetchone()[0]
+        cursor.execute(f'''
+            INSERT INTO {SCHEMA}.offers (game_id, category_id, seller_id, title, price)
+            VALUES (%s, %s, %s, %s, %s) RETURNING id
+        ''', (game_id, category_id, ids['seller'], f'{prefix} offer {suffix}', 100))
+        ids['offer'] = cursor.fetchone()[0]
+    conn.commit()
+    return ids
+
+
+def cleanup_marketplace(conn: Any, ids: Dict[str, int]) -> None:
+    with conn.cursor() as cursor:
+        cursor.execute(f'''
+            DELETE FROM {SCHEMA}.transactions
+            WHERE deal_id IN (SELECT id FROM {SCHEMA}.deals WHERE offer_id = %s)
+        ''', (ids['offer'],))
+        cursor.execute(f'DELETE FROM {SCHEMA}.seller_daily_stats WHERE seller_id = %s', (ids['seller'],))
+        cursor.execute(f'DELETE FROM {SCHEMA}.seller_offer_stats WHERE offer_id = %s', (ids['offer'],))
+        cursor.execute(f'DELETE FROM {SCHEMA}.seller_stats WHERE seller_id = %s', (ids['seller'],))
+        cursor.execute(f'DELETE FROM {SCHEMA}.deals WHERE offer_id = %s', (ids['offer'],))
+        cursor.execute(f'DELETE FROM {SCHEMA}.offers WHERE id = %s', (ids['offer'],))
+        cursor.execute(f'DELETE FROM {SCHEMA}.users WHERE id IN (%s, %s)', (ids['buyer'], ids['seller']))
+    conn.commit()
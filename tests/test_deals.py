@@ -0,0 +1,69 @@
+import time
+from typing import Any, Dict
+
+import psycopg2
+import pytest
+
+from conftest import SCHEMA, call
+
+
+def fetch_one(dsn: str, query: str, params: tuple) -> tuple:
+    conn = psycopg2.connect(dsn)
+    with conn.cursor() as cursor:
+        cursor.execute(query, params)
+        row = cursor.fetchone()
+    conn.close()
+    return row
+
+
+def test_deal_flow_moves_money_once(deals: Any, dsn: str, marketplace: Dict[str, int]) -> None:
+    buyer, seller = marketplace['buyer'], marketplace['seller']
+
+    created = call(deals, 'POST', buyer, {'action': 'create'}, {'offer_id': marketplace['offer']})
+    assert created['status_code'] == 200 and created['amount'] == 105
+    deal_id = created['deal_id']
+
+    assert call(deals, 'POST', buyer, {'action': 'pay'}, {'deal_id': deal_id})['status_code'] == 200
+    assert call(deals, 'POST', buyer, {'action': 'pay'}, {'deal_id': deal_id})['status_code'] == 400
+    assert call(deals, 'POST', buyer, {'action': 'complete'}, {'deal_id': deal_id})['status_code'] == 200
+    assert call(deals, 'POST', buyer, {'action': 'complete'}, {'deal_id': deal_id})['status_code'] == 400
+
+    assert fetch_one(dsn, f'SELECT balance FROM {SCHEMA}.users WHERE id = %s', (buyer,))[0] == 10 ** 6 - 105
+    assert fetch_one(dsn, f'SELECT balance FROM {SCHEMA}.users WHERE id = %s', (seller,))[0] == 99
+    assert fetch_one(dsn, f'SELECT count(*) FROM {SCHEMA}.transactions WHERE deal_id = %s', (deal_id,))[0] == 2
+
+
+def test_pay_statement_skips_deal_in_wrong_status(deals: Any, dsn: str, marketplace: Dict[str, int]) -> None:
+    buyer = marketplace['buyer']
+    deal_id = call(deals, 'POST', buyer, {'action': 'create'}, {'offer_id': marketplace['offer']})['deal_id']
+
+    # Два вызова, прошедших проверку статуса одновременно, доходят до deal_pay оба
+    cursor = deals.get_connection(dsn).cursor()
+    cursor.execute('EXECUTE deal_pay (%s, %s)', (deal_id, buyer))
+    assert cursor.fetchone() == (deal_id,)
+    cursor.execute('EXECUTE deal_pay (%s, %s)', (deal_id, buyer))
+    assert cursor.fetchone() is None
+
+    assert fetch_one(dsn, f'SELECT balance FROM {SCHEMA}.users WHERE id = %s', (buyer,))[0] == 10 ** 6 - 105
+
+
+def test_failed_transaction_does_not_poison_connection(deals: Any, dsn: str, marketplace: Dict[str, int]) -> None:
+    conn = deals.get_connection(dsn)
+    cursor = conn.cursor()
+    with pytest.raises(psycopg2.Error):
+        cursor.execute('BEGIN; EXECUTE deal_by_id (%s); SELECT 1 / 0; COMMIT', (0,))
+    assert conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_INERROR
+
+    deals.release_connection(conn)
+
+    assert deals.get_connection(dsn) is conn
+    assert call(deals, 'GET', marketplace['buyer'], {'action': 'my-deals'})['status_code'] == 200
+
+
+def test_dropped_connection_is_reopened(deals: Any, dsn: str, marketplace: Dict[str, int]) -> None:
+    conn = deals.get_connection(dsn)
+    fetch_one(dsn, 'SELECT pg_terminate_backend(%s)', (conn.info.backend_pid,))
+    time.sleep(0.1)
+
+    assert call(deals, 'GET', marketplace['buyer'], {'action': 'my-deals'})['status_code'] == 200
+    assert deals.get_connection(dsn) is not conn
@@ -0,0 +1,145 @@
+import base64
+import gzip
+import json
+from typing import Any, Dict, List
+
+import psycopg2
+import pytest
+
+from conftest import SCHEMA, load_function
+
+TOKEN = 'test-export-token'
+
+
+# Проверки токена срабатывают до подключения к базе, поэтому идут без неё
+UNUSED_DSN = 'postgresql://unused@localhost/unused'
+
+
+@pytest.fixture
+def export_module(monkeypatch: pytest.MonkeyPatch) -> Any:
+    monkeypatch.setenv('DATABASE_URL', UNUSED_DSN)
+    monkeypatch.setenv('EXPORT_TOKEN', TOKEN)
+    return load_function('export')
+
+
+@pytest.fixture
+def export(export_module: Any, monkeypatch: pytest.MonkeyPatch, dsn: str) -> Any:
+    monkeypatch.setenv('DATABASE_URL', dsn)
+    return export_module
+
+
+@pytest.fixture
+def deal_id(dsn: str, marketplace: Dict[str, int]) -> int:
+    conn = psycopg2.connect(dsn)
+    with conn.cursor() as cursor:
+        cursor.execute(f'''
+            INSERT INTO {SCHEMA}.deals (offer_id, buyer_id, seller_id, amount, status)
+            VALUES (%s, %s, %s, 105, 'pending') RETURNING id
+        ''', (marketplace['offer'], marketplace['buyer'], marketplace['seller']))
+        value = cursor.fetchone()[0]
+    conn.commit()
+    conn.close()
+    return value
+
+
+def call(module: Any, token: str, **params: str) -> Dict[str, Any]:
+    query = {'entity': 'deals', 'status': 'pending', **params}
+    return module.handler({
+        'httpMethod': 'GET',
+        'queryStringParameters': query,
+        'headers': {'X-Export-Token': token}
+    }, None)
+
+
+def exported_lines(response: Dict[str, Any]) -> List[str]:
+    return gzip.decompress(base64.b64decode(response['body'])).decode('utf-8').splitlines()
+
+
+def test_export_rejects_wrong_token(export_module: Any) -> None:
+    assert call(export_module, 'wrong')['statusCode'] == 403
+
+
+def test_export_disabled_without_token(export_module: Any, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.delenv('EXPORT_TOKEN')
+    assert call(export_module, '')['statusCode'] == 403
+
+
+def test_export_rejects_bad_cursor(export_module: Any) -> None:
+    assert call(export_module, TOKEN, after='not-a-cursor')['statusCode'] == 400
+
+
+def test_export_csv(export: Any, deal_id: int) -> None:
+    response = call(export, TOKEN)
+
+    assert response['statusCode'] == 200
+    assert int(response['headers']['X-Export-Rows']) >= 1
+    lines = exported_lines(response)
+    assert lines[0].startswith('id,created_at')
+    assert any(line.startswith(f'{deal_id},') for line in lines[1:])
+
+
+def test_export_ndjson(export: Any, deal_id: int) -> None:
+    response = call(export, TOKEN, format='ndjson')
+
+    assert response['statusCode'] == 200
+    lines = exported_lines(response)
+    assert len(lines) == int(response['headers']['X-Export-Rows'])
+    assert deal_id in [json.loads(line)['id'] for line in lines]
+
+
+def export_all(module: Any, **params: str) -> List[Dict[str, Any]]:
+    pages = []
+    while True:
+        response = call(module, TOKEN, format='ndjson', **params)
+        assert response['statusCode'] == 200
+        pages.append(response)
+        if 'X-Export-Next' not in response['headers']:
+            return pages
+        params['after'] = response['headers']['X-Export-Next']
+
+
+@pytest.fixture
+def five_deals(dsn: str, marketplace: Dict[str, int]) -> set:
+    conn = psycopg2.connect(dsn)
+    with conn.cursor() as cursor:
+        cursor.execute(f'''
+            INSERT INTO {SCHEMA}.deals (offer_id, buyer_id, seller_id, amount, status, created_at)
+            SELECT %s, %s, %s, 105, 'pending', CURRENT_TIMESTAMP - make_interval(secs => n)
+            FROM generate_series(1, 5) n
+            RETURNING id
+        ''', (marketplace['offer'], marketplace['buyer'], marketplace['seller']))
+        created = {row[0] for row in cursor.fetchall()}
+    conn.commit()
+    conn.close()
+
+    return created
+
+
+def test_export_pages_follow_cursor(export: Any, five_deals: set) -> None:
+    pages = export_all(export, limit='2')
+
+    exported = [json.loads(line)['id'] for page in pages for line in exported_lines(page)]
+    assert all(len(exported_lines(page)) <= 2 for page in pages)
+    assert len(exported) == len(set(exported))
+    assert five_deals <= set(exported)
+    assert len(pages) >= 3
+
+
+def test_export_shrinks_page_to_fit_cap(export: Any, five_deals: set, monkeypatch: pytest.MonkeyPatch) -> None:
+    full_page = export_all(export)[0]
+    monkeypatch.setattr(export, 'EXPORT_MAX_BYTES', len(base64.b64decode(full_page['body'])) - 1)
+
+    pages = export_all(export)
+
+    exported = [json.loads(line)['id'] for page in pages for line in exported_lines(page)]
+    assert five_deals <= set(exported)
+    assert int(pages[0]['headers']['X-Export-Limit']) < export.EXPORT_PAGE_ROWS
+
+
+def test_export_too_large(export: Any, deal_id: int, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(export, 'EXPORT_MAX_BYTES', 1)
+
+    response = call(export, TOKEN)
+
+    assert response['statusCode'] == 413
+    assert json.loads(response['body'])['max_bytes'] == 1